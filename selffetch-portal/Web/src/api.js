@@ -222,6 +222,10 @@ class ApiClient {
     if (type === "video") return `${this.base_url}/video/full/${media.id}`;
     return "";
   }
+  get_video_thumb_url(media, kind = "poster") {
+    if (!media || media.id === undefined || media.id === null) return "";
+    return `${this.base_url}/video/${kind}/${media.id}`;
+  }
 }
 
 /* =======================
@@ -281,6 +285,9 @@ export function get_media_preview_url(media, type = "image") {
 export function get_media_full_url(media, type = "image") {
   return api_client.get_media_full_url(media, type);
 }
+export function get_video_thumb_url(media, kind = "poster") {
+  return api_client.get_video_thumb_url(media, kind);
+}
 export async function preflight(ids, opts = {}) {
   if (!Array.isArray(ids) || !ids.length) return;
   _validate_ids_array("ids", ids);
@@ -337,6 +344,7 @@ export const fetchMediaWithTags = fetch_media_with_tags;
 export const fetchMediaWithTagsBatch = fetch_media_with_tags_batch;
 export const getMediaPreviewUrl = get_media_preview_url;
 export const getMediaFullUrl = get_media_full_url;
+export const getVideoThumbUrl = get_video_thumb_url;
 export const preflightCall = preflight;
 export const fetchRecommendations = fetch_recommendations;
 export const fetchMediaBatch = fetch_media_batch;
@@ -1,10 +1,12 @@
 import React, { useState } from 'react';
 import { useFavorites } from '../FavoriteContext';
-import { getMediaPreviewUrl } from '../api';
+import { getMediaPreviewUrl, getVideoThumbUrl } from '../api';
 
 /**
  * MediaCard
  * Render a media tile (image or video preview). Clicking favorite heart toggles favorite.
+ * Videos with server-side thumbnails (media.video_thumbs) show the poster frame and scrub the
+ * sprite sheet on hover instead of streaming the preview video.
  *
  * Props:
  *  - media: media object from API (id, type, ...)
@@ -37,11 +39,33 @@ function HeartIcon({ filled = false, class_name = "", title = "" }) {
   );
 }
 
+/**
+ * Background style showing one frame of a sprite sheet (frames in one row), cropped like object-cover.
+ * fraction: horizontal hover position in the card (0..1) picks the frame.
+ */
+function sprite_style(thumbs, url, fraction) {
+  const { frames, tile_width, tile_height } = thumbs;
+  const index = Math.min(frames - 1, Math.max(0, Math.floor(fraction * frames)));
+  // frame width in card widths: landscape frames overflow sideways, portrait ones vertically (centered)
+  const ratio = Math.max(tile_width / tile_height, 1);
+  const span = frames * ratio - 1;
+  const x = span > 0 ? ((index * ratio + (ratio - 1) / 2) / span) * 100 : 0;
+  return {
+    backgroundImage: `url(${url})`,
+    backgroundSize: `${frames * ratio * 100}% auto`,
+    backgroundPosition: `${x}% 50%`,
+    backgroundRepeat: 'no-repeat',
+  };
+}
 
 export default function MediaCard({ media, on_click }) {
   const { favoriteMediaIds, favoriteMedia, unfavoriteMedia } = useFavorites();
   const [img_error, set_img_error] = useState(false);
   const [video_preview, set_video_preview] = useState(false);
+  const [scrub, set_scrub] = useState(0);
+  const [thumbs_error, set_thumbs_error] = useState(false);
+
+  const thumbs = !thumbs_error ? media.video_thumbs : null;
 
   const is_favorite = favoriteMediaIds.includes(media.id);
 
@@ -55,8 +79,26 @@ export default function MediaCard({ media, on_click }) {
         className="w-full aspect-square relative group"
         onMouseEnter={() => set_video_preview(true)}
         onMouseLeave={() => set_video_preview(false)}
+        onMouseMove={thumbs ? e => {
+          const rect = e.currentTarget.getBoundingClientRect();
+          set_scrub((e.clientX - rect.left) / rect.width);
+        } : undefined}
       >
-        {media.type === 1 ? (
+        {media.type === 1 && thumbs ? (
+          video_preview ? (
+            <div
+              className="w-full aspect-square rounded-t bg-gray-200 dark:bg-gray-700"
+              style={sprite_style(thumbs, getVideoThumbUrl(media, 'sprite'), scrub)}
+            />
+          ) : (
+            <img
+              src={getVideoThumbUrl(media, 'poster')}
+              alt={media.id}
+              className="w-full aspect-square object-cover rounded-t"
+              onError={() => set_thumbs_error(true)}
+            />
+          )
+        ) : media.type === 1 ? (
           video_preview ? (
             <video
               src={getMediaPreviewUrl(media, 'video')}
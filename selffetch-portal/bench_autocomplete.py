@@ -0,0 +1,120 @@
+"""
+Autocomplete benchmark: /search_tags_by_prefix through SQL (TAG_PREFIX_SQL, ILIKE) vs the
+in-memory TagPrefixIndex, for random prefixes of real tag values.
+
+Also checks that both return the same ranking (compared by count, ties may differ) and
+writes latencies per prefix length into a JSON report.
+
+With --fuzzy the same keywords (plus a typo) go through /search_tags_fuzzy instead: pg_trgm KNN
+(fetch_fuzzy_tags) vs the in-memory TagTrigramIndex, rankings compared by similarity.
+
+Usage:
+    python bench_autocomplete.py --dsn postgresql://postgres:p@localhost:5432/rupat_bench --keywords 200
+    python bench_autocomplete.py --fuzzy --threshold 0.3
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import asyncpg
+
+from bench_search import summarize
+from mediaAPI import DB_DSN, TAG_PREFIX_SQL, TagTrigramIndex, fetch_fuzzy_tags
+
+
+async def pick_keywords(conn, args) -> list:
+    """Random prefixes (length 2..args.max_length) of random tag values, some upper-cased."""
+    rng = random.Random(args.seed)
+    values = [r["value"] for r in await conn.fetch("SELECT value FROM tags")]
+    keywords = []
+    for _ in range(args.keywords):
+        value = rng.choice(values)
+        keyword = value[:rng.randint(2, args.max_length)]
+        if args.fuzzy and len(keyword) > 3:
+            # drop one character so the lookup has to tolerate a typo
+            cut = rng.randrange(len(keyword))
+            keyword = keyword[:cut] + keyword[cut + 1:]
+        keywords.append(keyword.upper() if rng.random() < 0.2 else keyword)
+    return keywords
+
+
+async def sql_lookup(conn, args, keyword: str) -> list:
+    """The lookup the endpoint runs without the in-memory index."""
+    if args.fuzzy:
+        return await fetch_fuzzy_tags(conn, keyword, args.threshold, args.limit)
+    # ILIKE treats "_" as a wildcard; escape it so both sides search the same literal prefix
+    sql_keyword = keyword.replace("\\", "\\\\").replace("_", "\\_").replace("%", "\\%")
+    return await conn.fetch(TAG_PREFIX_SQL, sql_keyword, args.limit)
+
+
+def memory_lookup(index, args, keyword: str) -> list:
+    """The same lookup against the loaded TagTrigramIndex."""
+    if args.fuzzy:
+        return index.fuzzy_search(keyword, args.limit, args.threshold)
+    return index.search(keyword, args.limit)
+
+
+def ranking(rows: list, args) -> list:
+    """Comparable ranking key: similarity (float4 in SQL) for fuzzy, count for prefix."""
+    if args.fuzzy:
+        return [round(r["sim"], 4) for r in rows]
+    return [r["count"] for r in rows]
+
+
+async def main(args):
+    pool = await asyncpg.create_pool(args.dsn, min_size=1, max_size=2)
+    try:
+        index = TagTrigramIndex()
+        await index.load(pool)
+        async with pool.acquire() as conn:
+            keywords = await pick_keywords(conn, args)
+            by_length = {}
+            mismatches = 0
+            for keyword in keywords:
+                await sql_lookup(conn, args, keyword)
+                samples = by_length.setdefault(len(keyword), {"sql": [], "memory": []})
+                for _ in range(args.runs):
+                    started = time.perf_counter()
+                    sql_rows = await sql_lookup(conn, args, keyword)
+                    samples["sql"].append((time.perf_counter() - started) * 1000)
+                    started = time.perf_counter()
+                    memory_rows = memory_lookup(index, args, keyword)
+                    samples["memory"].append((time.perf_counter() - started) * 1000)
+                if ranking(sql_rows, args) != ranking(memory_rows, args):
+                    mismatches += 1
+                    print(f"[main] ranking differs for {keyword!r}")
+    finally:
+        await pool.close()
+
+    report = {"mode": "fuzzy" if args.fuzzy else "prefix", "keywords": len(keywords), "limit": args.limit,
+              "mismatches": mismatches, "results": []}
+    for length in sorted(by_length):
+        for kind in ("sql", "memory"):
+            summary = summarize(by_length[length][kind])
+            report["results"].append({"kind": kind, "prefix_length": length, **summary})
+            print(f"[main] {kind:<6} prefix_length={length} p50={summary['p50_ms'] * 1000:>9.1f}us "
+                  f"p95={summary['p95_ms'] * 1000:>9.1f}us")
+    print(f"[main] {mismatches} ranking mismatches out of {len(keywords)} keywords")
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[main] report written to {args.out}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark tag autocomplete: SQL vs in-memory prefix/trigram index.")
+    parser.add_argument("--dsn", default=DB_DSN)
+    parser.add_argument("--keywords", type=int, default=200, help="number of random prefixes")
+    parser.add_argument("--max-length", type=int, default=6, help="longest prefix length")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--fuzzy", action="store_true", help="benchmark fuzzy lookups instead of prefix lookups")
+    parser.add_argument("--threshold", type=float, default=0.2, help="similarity threshold for --fuzzy")
+    parser.add_argument("--runs", type=int, default=5, help="timed runs per keyword (after one warm-up)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--out", default="bench_autocomplete.json")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,251 @@
+"""
+Query benchmark for the tag search endpoints.
+
+Runs representative include/exclude/favorite searches at several offsets through the same
+code path as the server (mediaAPI.search_media_page, per engine), plus the tag prefix/fuzzy
+lookups, and records latencies and EXPLAIN ANALYZE plans per query shape into a JSON report.
+
+Meant to run against a database filled by gen_dataset.py (or a copy of the real dump).
+
+Usage:
+    python bench_search.py --dsn postgresql://postgres:p@localhost:5432/rupat_bench --offsets 0,1000,10000
+    python bench_search.py --engines sql,array,memory   # compare search engines
+    python bench_search.py --engines sql,planned        # planner choices vs the plain query
+    python bench_search.py --count-modes exact,estimate,none   # cost of the total
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import asyncpg
+
+from mediaAPI import (
+    COUNT_MODES,
+    DB_DSN,
+    SEARCH_ENGINES,
+    TAG_FUZZY_SQL,
+    TAG_PREFIX_SQL,
+    SearchMediaByTagsRequest,
+    build_search_query,
+    count_cache,
+    encode_cursor,
+    fetch_fuzzy_tags,
+    prepare_search_terms,
+    search_media_page,
+    tag_index,
+)
+
+
+async def pick_tags(conn) -> dict:
+    """
+    Pick tag values by popularity bucket from the target database.
+    common: the most used tags, medium: around the 1% rank, rare: a few dozen postings.
+    """
+    total_tags = await conn.fetchval("SELECT COUNT(*) FROM tags")
+    common = await conn.fetch("SELECT value FROM tags ORDER BY count DESC NULLS LAST LIMIT 3")
+    medium = await conn.fetch(
+        "SELECT value FROM tags ORDER BY count DESC NULLS LAST OFFSET $1 LIMIT 2", max(3, total_tags // 100)
+    )
+    rare = await conn.fetch("SELECT value FROM tags WHERE count BETWEEN 20 AND 200 ORDER BY count LIMIT 2")
+    picked = {
+        "common": [r["value"] for r in common],
+        "medium": [r["value"] for r in medium],
+        "rare": [r["value"] for r in rare],
+    }
+    if not all(picked.values()):
+        raise SystemExit(f"[pick_tags] not enough tags in each bucket: {picked}")
+    return picked
+
+
+def search_shapes(tags: dict) -> dict:
+    """Representative search requests keyed by shape name."""
+    common, medium, rare = tags["common"], tags["medium"], tags["rare"]
+    return {
+        "no_filter": dict(),
+        "include_common": dict(include_tags=[common[0]]),
+        "include_medium": dict(include_tags=[medium[0]]),
+        "include_rare": dict(include_tags=[rare[0]]),
+        "include_rare_common": dict(include_tags=[rare[0], common[0]]),
+        "include_common_common": dict(include_tags=common[:2]),
+        "include_3_mixed": dict(include_tags=[common[0], medium[0], rare[0]]),
+        "exclude_common": dict(exclude_tags=[common[0]]),
+        "include_common_exclude_medium": dict(include_tags=[common[0]], exclude_tags=[medium[0]]),
+        "favorite_only": dict(favorite_only=True),
+        "favorite_include_common": dict(favorite_only=True, include_tags=[common[0]]),
+    }
+
+
+def summarize(samples: list) -> dict:
+    """Latency summary in milliseconds."""
+    samples = sorted(samples)
+    p95_index = min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))
+    return {
+        "min_ms": round(samples[0], 3),
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[p95_index], 3),
+        "max_ms": round(samples[-1], 3),
+    }
+
+
+async def time_call(make_call, runs: int):
+    """Await make_call() once to warm up, then `runs` timed times. Returns (summary, last_result)."""
+    result = await make_call()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = await make_call()
+        samples.append((time.perf_counter() - started) * 1000)
+    return summarize(samples), result
+
+
+async def time_query(conn, query: str, params: list, runs: int):
+    """time_call for a plain query. Returns (summary, last_rows)."""
+    return await time_call(lambda: conn.fetch(query, *params), runs)
+
+
+async def explain(conn, query: str, params: list) -> dict:
+    """EXPLAIN (ANALYZE, BUFFERS) in JSON format; returns the top-level plan object."""
+    raw = await conn.fetchval("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, *params)
+    plan = json.loads(raw)[0] if isinstance(raw, str) else raw[0]
+    return plan
+
+
+async def keyset_cursor_at(conn, fields: dict, offset: int):
+    """Cursor pointing just before position `offset`, so a keyset page starts where the offset page does."""
+    req = SearchMediaByTagsRequest(limit=1, offset=offset - 1, engine="sql", count_mode="none", **fields)
+    _, rows, _, _ = await search_media_page(conn, req)
+    return encode_cursor(rows[0]["created"], rows[0]["id"], "next") if rows else None
+
+
+async def search_uncached(conn, req):
+    """search_media_page with an empty count cache, so exact totals are really counted."""
+    count_cache.clear()
+    return await search_media_page(conn, req)
+
+
+async def bench_search(conn, args, tags: dict) -> list:
+    """Search shapes x offsets x paging x engines x count modes; exact totals are timed uncached."""
+    results = []
+    for shape, fields in search_shapes(tags).items():
+        for offset in args.offsets:
+            # offset paging always; keyset paging for deep pages (same rows, cursor instead of OFFSET)
+            variants = [("offset", dict(offset=offset))]
+            if args.keyset and offset > 0:
+                cursor = await keyset_cursor_at(conn, fields, offset)
+                if cursor:
+                    variants.append(("keyset", dict(cursor=cursor)))
+            for paging, page_fields in variants:
+                for engine, count_mode in ((e, c) for e in args.engines for c in args.count_modes):
+                    req = SearchMediaByTagsRequest(limit=args.limit, engine=engine, count_mode=count_mode,
+                                                   **page_fields, **fields)
+                    summary, (total, rows, _, _) = await time_call(lambda: search_uncached(conn, req), args.runs)
+                    entry = {
+                        "kind": "search",
+                        "engine": engine,
+                        "count_mode": count_mode,
+                        "paging": paging,
+                        "shape": shape,
+                        "offset": offset,
+                        "limit": args.limit,
+                        "request": fields,
+                        "rows": len(rows),
+                        "total": total,
+                        **summary,
+                    }
+                    if engine == "planned" or (args.explain and engine != "memory"):
+                        tag_ids, plan = await prepare_search_terms(conn, req, engine)
+                        if plan is not None:
+                            entry["tag_plan"] = plan.describe()
+                    if args.explain and engine != "memory":
+                        query, params = build_search_query(req, engine, tag_ids, plan)
+                        plan = await explain(conn, query, params)
+                        entry["execution_ms"] = plan.get("Execution Time")
+                        entry["planning_ms"] = plan.get("Planning Time")
+                        entry["plan"] = plan["Plan"]
+                    results.append(entry)
+                    print(f"[bench_search] {engine:<7} {count_mode:<8} {paging:<6} {shape:<32} offset={offset:<6} "
+                          f"p50={summary['p50_ms']:>9.2f}ms p95={summary['p95_ms']:>9.2f}ms "
+                          f"rows={entry['rows']} total={entry['total']}")
+    return results
+
+
+async def bench_tag_lookups(conn, args, tags: dict) -> list:
+    """Prefix and fuzzy tag lookups using keywords derived from the picked tags."""
+    results = []
+    keywords = [tags["common"][0][:2], tags["medium"][0][:3], tags["rare"][0][:5]]
+    for keyword in keywords:
+        for kind, query, params in (
+            ("prefix", TAG_PREFIX_SQL, [keyword, 20]),
+            ("fuzzy", TAG_FUZZY_SQL, [keyword, 20]),
+        ):
+            if kind == "fuzzy":
+                summary, rows = await time_call(lambda: fetch_fuzzy_tags(conn, keyword, 0.2, 20), args.runs)
+            else:
+                summary, rows = await time_query(conn, query, params, args.runs)
+            entry = {"kind": kind, "shape": f"{kind}:{len(keyword)}", "keyword": keyword, "rows": len(rows), **summary}
+            if args.explain:
+                plan = await explain(conn, query, params)
+                entry["execution_ms"] = plan.get("Execution Time")
+                entry["plan"] = plan["Plan"]
+            results.append(entry)
+            print(f"[bench_tag_lookups] {kind:<6} keyword={keyword!r:<10} p50={summary['p50_ms']:>9.2f}ms "
+                  f"p95={summary['p95_ms']:>9.2f}ms rows={entry['rows']}")
+    return results
+
+
+async def main(args):
+    if "memory" in args.engines:
+        pool = await asyncpg.create_pool(args.dsn, min_size=1, max_size=2)
+        try:
+            await tag_index.load(pool)
+        finally:
+            await pool.close()
+        if not tag_index.ready:
+            raise SystemExit("[main] in-memory tag index failed to load (is numpy installed?)")
+
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        tags = await pick_tags(conn)
+        print(f"[main] picked tags: {tags}")
+        report = {
+            "database": args.dsn.rsplit("/", 1)[-1],
+            "server_version": str(conn.get_server_version()),
+            "media_rows": await conn.fetchval("SELECT reltuples::bigint FROM pg_class WHERE relname = 'media'"),
+            "runs": args.runs,
+            "engines": args.engines,
+            "count_modes": args.count_modes,
+            "tags": tags,
+            "results": [],
+        }
+        report["results"] += await bench_search(conn, args, tags)
+        if not args.skip_tags:
+            report["results"] += await bench_tag_lookups(conn, args, tags)
+    finally:
+        await conn.close()
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"[main] report written to {args.out}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark tag search query shapes and record EXPLAIN ANALYZE plans.")
+    parser.add_argument("--dsn", default=DB_DSN)
+    parser.add_argument("--runs", type=int, default=5, help="timed runs per query (after one warm-up)")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--offsets", type=lambda v: [int(x) for x in v.split(",")], default=[0, 1000, 10000])
+    parser.add_argument("--engines", type=lambda v: v.split(","), default=["sql"],
+                        help=f"comma separated search engines to compare ({', '.join(SEARCH_ENGINES)})")
+    parser.add_argument("--count-modes", type=lambda v: v.split(","), default=["exact"],
+                        help=f"comma separated total count modes to compare ({', '.join(COUNT_MODES)})")
+    parser.add_argument("--no-keyset", dest="keyset", action="store_false", help="skip keyset (cursor) paging runs")
+    parser.add_argument("--no-explain", dest="explain", action="store_false", help="skip EXPLAIN ANALYZE capture")
+    parser.add_argument("--skip-tags", action="store_true", help="skip prefix/fuzzy tag lookups")
+    parser.add_argument("--out", default="bench_report.json")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,168 @@
+"""
+Bulk-insert benchmark for tags.count maintenance: media_tags loads with the per-row trigger of
+db.sql ("row") vs the statement-level triggers of migrations/007 ("statement"), with no count
+trigger at all ("none") as the floor.
+
+Each mode x insert method runs inside a transaction that is rolled back, trigger setup included,
+so this can point at a copy of the real dump without changing it. Posts get Zipf-distributed tags
+from the existing ones (a few very popular tags in every batch, like a scraper load), and after each
+run the tags.count deltas are checked against the inserted rows.
+
+Insert methods:
+    copy        - COPY per batch (what gen_dataset.py does)
+    unnest      - one INSERT ... SELECT FROM unnest($1, $2) per batch
+    executemany - one single-row INSERT per media_tags row
+
+Usage:
+    python bench_tag_count.py --dsn postgresql://postgres:p@localhost:5432/rupat_bench --posts 2000
+    python bench_tag_count.py --isolate   # also disable the other media_tags triggers (notify, tag_ids sync)
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import pathlib
+import random
+import time
+
+import asyncpg
+
+from mediaAPI import DB_DSN
+
+MODES = ("none", "row", "statement")
+METHODS = ("copy", "unnest", "executemany")
+COUNT_TRIGGERS = ("trg_update_tag_count", "trg_update_tag_count_insert", "trg_update_tag_count_delete")
+STATEMENT_MIGRATION = pathlib.Path(__file__).parent / "migrations" / "007_tag_count_statement_trigger.sql"
+
+
+async def setup_mode(conn, mode: str, isolate: bool):
+    """Install the tags.count trigger(s) of one mode (inside the caller's transaction)."""
+    if isolate:
+        await conn.execute("ALTER TABLE media_tags DISABLE TRIGGER USER")
+    for name in COUNT_TRIGGERS:
+        await conn.execute(f"DROP TRIGGER IF EXISTS {name} ON media_tags")
+    if mode == "row":
+        await conn.execute(
+            "CREATE TRIGGER trg_update_tag_count AFTER INSERT OR DELETE ON media_tags "
+            "FOR EACH ROW EXECUTE FUNCTION update_tag_count()"
+        )
+    elif mode == "statement":
+        await conn.execute(STATEMENT_MIGRATION.read_text(encoding="utf-8"))
+
+
+def make_posts(args, tag_ids: list, first_media_id: int) -> list:
+    """(media_id, tag_id) rows for args.posts posts, tags drawn with Zipf weights over tag_ids."""
+    rng = random.Random(args.seed)
+    cum_weights = list(itertools.accumulate(1.0 / rank ** args.zipf for rank in range(1, len(tag_ids) + 1)))
+    rows = []
+    for media_id in range(first_media_id, first_media_id + args.posts):
+        for tag_id in set(rng.choices(tag_ids, cum_weights=cum_weights, k=args.tags_per_post)):
+            rows.append((media_id, tag_id))
+    return rows
+
+
+async def insert_batch(conn, method: str, rows: list):
+    """Insert one batch of (media_id, tag_id) rows with the given method."""
+    if method == "copy":
+        await conn.copy_records_to_table("media_tags", records=rows, columns=["media_id", "tag_id"])
+    elif method == "unnest":
+        await conn.execute(
+            "INSERT INTO media_tags (media_id, tag_id) SELECT * FROM unnest($1::bigint[], $2::bigint[])",
+            [r[0] for r in rows], [r[1] for r in rows],
+        )
+    else:
+        await conn.executemany("INSERT INTO media_tags (media_id, tag_id) VALUES ($1, $2)", rows)
+
+
+async def run_one(conn, args, mode: str, method: str, tag_ids: list) -> dict:
+    """Load all posts in batches with one mode/method, check the counts, roll everything back."""
+    # rolled back runs leave dead tags row versions behind; start every run from a clean table
+    await conn.execute("VACUUM tags")
+    tr = conn.transaction()
+    await tr.start()
+    try:
+        await setup_mode(conn, mode, args.isolate)
+        first_media_id = await conn.fetchval("SELECT COALESCE(MAX(id), 0) + 1 FROM media")
+        rows = make_posts(args, tag_ids, first_media_id)
+        await conn.copy_records_to_table(
+            "media", records=[(i,) for i in range(first_media_id, first_media_id + args.posts)], columns=["id"]
+        )
+        touched = sorted({r[1] for r in rows})
+        before = dict(await conn.fetch("SELECT id, COALESCE(count, 0) FROM tags WHERE id = ANY($1::bigint[])", touched))
+
+        by_post = itertools.groupby(rows, key=lambda r: r[0])
+        batches = []
+        for _, group in itertools.groupby(enumerate(by_post), key=lambda e: e[0] // args.batch):
+            batches.append([row for _, (_, post_rows) in group for row in post_rows])
+        started = time.perf_counter()
+        for batch in batches:
+            await insert_batch(conn, method, batch)
+        elapsed = time.perf_counter() - started
+
+        after = dict(await conn.fetch("SELECT id, COALESCE(count, 0) FROM tags WHERE id = ANY($1::bigint[])", touched))
+        expected = {}
+        for _, tag_id in rows:
+            expected[tag_id] = expected.get(tag_id, 0) + 1
+        counts_ok = mode == "none" or all(after[t] - before[t] == expected[t] for t in touched)
+    finally:
+        await tr.rollback()
+    return {
+        "mode": mode,
+        "method": method,
+        "posts": args.posts,
+        "rows": len(rows),
+        "batches": len(batches),
+        "seconds": round(elapsed, 3),
+        "rows_per_s": round(len(rows) / elapsed),
+        "counts_ok": counts_ok,
+    }
+
+
+async def main(args):
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        if "statement" in args.modes and not STATEMENT_MIGRATION.exists():
+            raise SystemExit(f"[main] {STATEMENT_MIGRATION} not found")
+        tag_ids = [r["id"] for r in await conn.fetch(
+            "SELECT id FROM tags ORDER BY count DESC NULLS LAST LIMIT $1", args.tag_pool
+        )]
+        if not tag_ids:
+            raise SystemExit("[main] no tags in the target database")
+        results = []
+        for method in args.methods:
+            for mode in args.modes:
+                entry = await run_one(conn, args, mode, method, tag_ids)
+                results.append(entry)
+                print(f"[main] {method:<11} {mode:<9} {entry['rows']} rows in {entry['batches']} batches "
+                      f"{entry['seconds']:>7.3f}s {entry['rows_per_s']:>8} rows/s counts_ok={entry['counts_ok']}")
+    finally:
+        await conn.close()
+
+    report = {"isolate": args.isolate, "batch_posts": args.batch, "tags_per_post": args.tags_per_post,
+              "results": results}
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[main] report written to {args.out}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark media_tags bulk inserts with row vs statement tags.count triggers.")
+    parser.add_argument("--dsn", default=DB_DSN)
+    parser.add_argument("--posts", type=int, default=2000, help="posts (media rows) to load per run")
+    parser.add_argument("--tags-per-post", type=int, default=12)
+    parser.add_argument("--batch", type=int, default=100, help="posts per insert statement/COPY")
+    parser.add_argument("--tag-pool", type=int, default=5000, help="draw tags from the N most used ones")
+    parser.add_argument("--zipf", type=float, default=1.07, help="Zipf exponent over the tag pool")
+    parser.add_argument("--modes", type=lambda v: v.split(","), default=list(MODES),
+                        help=f"comma separated ({', '.join(MODES)})")
+    parser.add_argument("--methods", type=lambda v: v.split(","), default=list(METHODS),
+                        help=f"comma separated ({', '.join(METHODS)})")
+    parser.add_argument("--isolate", action="store_true",
+                        help="disable the other user triggers on media_tags during the runs")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--out", default="bench_tag_count.json")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
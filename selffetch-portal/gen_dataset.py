@@ -0,0 +1,200 @@
+"""
+Synthetic dataset generator for the selffetch-portal schema (db.sql).
+
+Fills media / tags / media_tags / media_sources / favorite_media with millions of rows so
+search plans can be checked on something bigger than the personal dump.
+Tag usage follows a Zipf distribution (a handful of huge tags, a long tail of rare ones),
+which is what the real scraped data looks like.
+
+Usage:
+    python gen_dataset.py --dsn postgresql://postgres:p@localhost:5432/rupat_bench --schema db.sql --media 2000000
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import asyncpg
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_DSN = os.getenv("DB_DSN", "postgresql://postgres:p@localhost:5432/rupat_bench")
+
+# Syllables used to build pronounceable tag values (gives autocomplete/fuzzy search realistic prefixes)
+SYLLABLES = [
+    "ka", "ri", "mo", "to", "na", "shi", "ro", "yu", "me", "ai", "ko", "sa", "ne", "hi", "mi",
+    "lu", "zen", "ban", "dor", "fel", "gar", "hol", "jin", "kel", "lor", "mar", "nor", "pel",
+]
+
+
+def make_tag_value(rank: int, rng: random.Random) -> str:
+    """Build a unique tag value; the rank suffix keeps values unique, syllables give shared prefixes."""
+    parts = [rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3))]
+    word = "".join(parts)
+    if rng.random() < 0.3:
+        word += "_" + "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 2)))
+    return f"{word}{rank}" if rank > 200 else f"{word}_{rank}"
+
+
+def zipf_cum_weights(n: int, s: float) -> list:
+    """Cumulative Zipf weights for ranks 1..n (for random.choices(cum_weights=...))."""
+    return list(itertools.accumulate(1.0 / (r ** s) for r in range(1, n + 1)))
+
+
+async def apply_schema(conn, schema_path: str):
+    """Run db.sql against an empty database."""
+    with open(schema_path, "r", encoding="utf-8") as f:
+        sql = f.read()
+    await conn.execute(sql)
+    # db.sql clears search_path; restore it for the rest of the session
+    await conn.execute("SELECT pg_catalog.set_config('search_path', 'public', false)")
+    print(f"[apply_schema] applied {schema_path}")
+
+
+async def load_tags(conn, args, rng: random.Random):
+    """Insert tag rows 1..args.tags (tag id == Zipf rank)."""
+    records = [
+        (rank, make_tag_value(rank, rng), rng.randint(0, 5), int(args.tags / rank), 0)
+        for rank in range(1, args.tags + 1)
+    ]
+    await conn.copy_records_to_table("tags", records=records, columns=["id", "value", "type", "popularity", "count"])
+    print(f"[load_tags] {len(records)} tags")
+
+
+def media_batches(args, rng: random.Random, cum_weights: list):
+    """
+    Yield (media_records, media_tag_records, source_records) batches.
+    created is spread over args.days days so ORDER BY created DESC has a realistic spread.
+    """
+    newest = datetime(2025, 11, 1)
+    span_seconds = args.days * 86400
+    tag_ids = range(1, args.tags + 1)
+    sizes = [(1080, 1920), (1920, 1080), (720, 1280), (1280, 720), (1000, 1000), (2048, 1536)]
+
+    media_id = args.start_id
+    remaining = args.media
+    while remaining > 0:
+        n = min(args.batch, remaining)
+        media_records = []
+        media_tag_records = []
+        source_records = []
+        for _ in range(n):
+            created = newest - timedelta(seconds=rng.randrange(span_seconds))
+            posted = created + timedelta(seconds=rng.randrange(3600))
+            width, height = rng.choice(sizes)
+            media_records.append((
+                media_id,
+                created,
+                posted,
+                int(rng.paretovariate(1.2)) - 1,   # likes: heavy tail
+                1 if rng.random() < args.video_ratio else 0,
+                1,
+                rng.randint(1, args.uploaders),
+                width,
+                height,
+            ))
+            # tags per media: roughly normal around the mean, at least 1
+            k = max(1, int(rng.gauss(args.tags_per_media, args.tags_per_media / 3)))
+            for tag_id in set(rng.choices(tag_ids, cum_weights=cum_weights, k=k)):
+                media_tag_records.append((media_id, tag_id))
+            if rng.random() < args.source_ratio:
+                source_records.append((media_id, f"https://source.example.com/{media_id}"))
+            media_id += 1
+        remaining -= n
+        yield media_records, media_tag_records, source_records
+
+
+async def load_media(conn, args, rng: random.Random):
+    """Stream media, media_tags and media_sources through COPY in batches."""
+    cum_weights = zipf_cum_weights(args.tags, args.zipf)
+    # tags.count triggers (per row in db.sql, per statement after migrations/007) would dominate the load;
+    # recompute counts set-based afterwards
+    count_triggers = [r["tgname"] for r in await conn.fetch(
+        "SELECT tgname FROM pg_trigger WHERE tgrelid = 'media_tags'::regclass AND tgname LIKE 'trg_update_tag_count%'"
+    )]
+    for name in count_triggers:
+        await conn.execute(f"ALTER TABLE media_tags DISABLE TRIGGER {name}")
+    try:
+        total_media = total_tags = 0
+        started = time.perf_counter()
+        for media_records, media_tag_records, source_records in media_batches(args, rng, cum_weights):
+            async with conn.transaction():
+                await conn.copy_records_to_table(
+                    "media", records=media_records,
+                    columns=["id", "created", "posted", "likes", "type", "status", "uploader_id", "width", "height"],
+                )
+                await conn.copy_records_to_table("media_tags", records=media_tag_records, columns=["media_id", "tag_id"])
+                if source_records:
+                    await conn.copy_records_to_table("media_sources", records=source_records, columns=["media_id", "source"])
+            total_media += len(media_records)
+            total_tags += len(media_tag_records)
+            elapsed = time.perf_counter() - started
+            print(f"[load_media] {total_media}/{args.media} media, {total_tags} media_tags ({total_media / elapsed:.0f} media/s)")
+    finally:
+        for name in count_triggers:
+            await conn.execute(f"ALTER TABLE media_tags ENABLE TRIGGER {name}")
+
+    await conn.execute("""
+        UPDATE tags t
+        SET count = c.n
+        FROM (SELECT tag_id, COUNT(*) AS n FROM media_tags GROUP BY tag_id) c
+        WHERE c.tag_id = t.id
+    """)
+    print("[load_media] tags.count recomputed")
+
+
+async def load_favorites(conn, args, rng: random.Random):
+    """Favorite a random sample of the generated media."""
+    if args.favorites <= 0:
+        return
+    population = range(args.start_id, args.start_id + args.media)
+    picked = rng.sample(population, min(args.favorites, args.media))
+    await conn.copy_records_to_table("favorite_media", records=[(mid,) for mid in picked], columns=["media_id"])
+    print(f"[load_favorites] {len(picked)} favorites")
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        if args.schema:
+            await apply_schema(conn, args.schema)
+        if args.truncate:
+            await conn.execute("TRUNCATE media, tags, media_tags, media_sources, favorite_media RESTART IDENTITY CASCADE")
+            print("[main] truncated existing data")
+        started = time.perf_counter()
+        await load_tags(conn, args, rng)
+        await load_media(conn, args, rng)
+        await load_favorites(conn, args, rng)
+        await conn.execute("ANALYZE media, tags, media_tags, media_sources, favorite_media")
+        print(f"[main] done in {time.perf_counter() - started:.1f}s")
+    finally:
+        await conn.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fill the selffetch-portal schema with a synthetic Zipf-distributed dataset.")
+    parser.add_argument("--dsn", default=DEFAULT_DSN, help="target database (use a scratch database, not the real dump)")
+    parser.add_argument("--schema", default=None, help="apply this schema file first (e.g. db.sql) on an empty database")
+    parser.add_argument("--truncate", action="store_true", help="truncate generated tables before loading")
+    parser.add_argument("--media", type=int, default=2_000_000, help="number of media rows")
+    parser.add_argument("--start-id", type=int, default=1, help="first media id")
+    parser.add_argument("--tags", type=int, default=50_000, help="number of distinct tags")
+    parser.add_argument("--zipf", type=float, default=1.07, help="Zipf exponent for tag usage")
+    parser.add_argument("--tags-per-media", type=float, default=12.0, help="mean tags per media")
+    parser.add_argument("--favorites", type=int, default=20_000, help="number of favorite_media rows")
+    parser.add_argument("--uploaders", type=int, default=20_000, help="distinct uploader ids")
+    parser.add_argument("--video-ratio", type=float, default=0.2, help="fraction of media with type=1 (video)")
+    parser.add_argument("--source-ratio", type=float, default=0.3, help="fraction of media with a media_sources row")
+    parser.add_argument("--days", type=int, default=3650, help="spread of media.created in days")
+    parser.add_argument("--batch", type=int, default=50_000, help="media rows per COPY batch")
+    parser.add_argument("--seed", type=int, default=1234)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,76 @@
+"""
+Bulk metadata ingest from the command line: the same COPY-into-staging + set-based merge as
+POST /ingest (mediaAPI.ingest_ndjson / ingest_csv), reading files or stdin.
+
+NDJSON input is one post per line (id, created, posted, likes, type, status, uploaderId, width,
+height, tags, source); CSV input targets one table and needs a header row with column names.
+tags.count is maintained by the media_tags triggers (apply migrations/007 for bulk loads).
+
+Usage:
+    python ingest.py posts.ndjson more_posts.ndjson --batch 5000
+    python ingest.py --format csv --table media_tags media_tags.csv
+    cat posts.ndjson | python ingest.py -
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+import asyncpg
+
+from mediaAPI import DB_DSN, INGEST_BATCH_SIZE, INGEST_COLUMNS, ingest_csv, ingest_ndjson
+
+READ_CHUNK = 1 << 20
+
+
+async def read_chunks(path: str):
+    """Yield a file (or stdin for "-") in byte chunks."""
+    f = sys.stdin.buffer if path == "-" else open(path, "rb")
+    try:
+        while True:
+            chunk = await asyncio.to_thread(f.read, READ_CHUNK)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+
+
+async def main(args):
+    pool = await asyncpg.create_pool(args.dsn, min_size=1, max_size=2)
+    try:
+        reports = []
+        for path in args.paths:
+            if args.format == "csv":
+                report = await ingest_csv(pool, args.table, read_chunks(path))
+            else:
+                report = await ingest_ndjson(pool, read_chunks(path), args.batch)
+            reports.append({"path": path, **report})
+            print(f"[main] {path}: {report['posts']} posts, {report['rows']} rows in {report['seconds']}s "
+                  f"({report['rows_per_s']} rows/s, tag counts via {report['tag_count_trigger']} trigger)")
+    finally:
+        await pool.close()
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+        print(f"[main] report written to {args.out}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bulk ingest media metadata (NDJSON posts or per-table CSV).")
+    parser.add_argument("paths", nargs="+", help="input files, - for stdin")
+    parser.add_argument("--dsn", default=DB_DSN)
+    parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    parser.add_argument("--table", choices=tuple(INGEST_COLUMNS), help="target table for --format csv")
+    parser.add_argument("--batch", type=int, default=INGEST_BATCH_SIZE, help="NDJSON posts per transaction")
+    parser.add_argument("--out", default=None, help="write the per-file reports to this JSON file")
+    args = parser.parse_args()
+    if args.format == "csv" and not args.table:
+        parser.error("--table is required with --format csv")
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
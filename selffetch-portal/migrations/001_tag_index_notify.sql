@@ -0,0 +1,85 @@
+--
+-- Change notifications for the in-memory tag index (SEARCH_ENGINE=memory).
+-- Payloads are compact colon-separated strings so a bulk scraper load stays cheap:
+--   media_changed          <op>:<media_id>:<created key>
+--   media_tags_changed     <op>:<media_id>:<tag_id>
+--   favorite_media_changed <op>:<media_id>
+--   tags_changed           <op>:<tag_id>:<value>
+-- op is I (insert), U (update) or D (delete).
+-- created key = -(epoch microseconds of media.created), empty when created is NULL.
+--
+
+CREATE OR REPLACE FUNCTION public.notify_media_changed() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    rec record;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        rec := OLD;
+    ELSE
+        rec := NEW;
+    END IF;
+    PERFORM pg_notify('media_changed', concat_ws(':',
+        left(TG_OP, 1),
+        rec.id,
+        COALESCE((-(extract(epoch FROM rec.created) * 1000000))::bigint::text, '')
+    ));
+    RETURN NULL;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION public.notify_media_tags_changed() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM pg_notify('media_tags_changed', concat_ws(':', 'I', NEW.media_id, NEW.tag_id));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('media_tags_changed', concat_ws(':', 'D', OLD.media_id, OLD.tag_id));
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION public.notify_favorite_media_changed() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM pg_notify('favorite_media_changed', concat_ws(':', 'I', NEW.media_id));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('favorite_media_changed', concat_ws(':', 'D', OLD.media_id));
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION public.notify_tags_changed() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('tags_changed', concat_ws(':', 'D', OLD.id, OLD.value));
+    ELSE
+        PERFORM pg_notify('tags_changed', concat_ws(':', left(TG_OP, 1), NEW.id, NEW.value));
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+
+DROP TRIGGER IF EXISTS trg_notify_media_changed ON public.media;
+CREATE TRIGGER trg_notify_media_changed AFTER INSERT OR DELETE OR UPDATE OF created ON public.media FOR EACH ROW EXECUTE FUNCTION public.notify_media_changed();
+
+DROP TRIGGER IF EXISTS trg_notify_media_tags_changed ON public.media_tags;
+CREATE TRIGGER trg_notify_media_tags_changed AFTER INSERT OR DELETE ON public.media_tags FOR EACH ROW EXECUTE FUNCTION public.notify_media_tags_changed();
+
+DROP TRIGGER IF EXISTS trg_notify_favorite_media_changed ON public.favorite_media;
+CREATE TRIGGER trg_notify_favorite_media_changed AFTER INSERT OR DELETE ON public.favorite_media FOR EACH ROW EXECUTE FUNCTION public.notify_favorite_media_changed();
+
+DROP TRIGGER IF EXISTS trg_notify_tags_changed ON public.tags;
+CREATE TRIGGER trg_notify_tags_changed AFTER INSERT OR DELETE OR UPDATE OF value ON public.tags FOR EACH ROW EXECUTE FUNCTION public.notify_tags_changed();
@@ -0,0 +1,89 @@
+--
+-- Denormalized tag id array on media for the "array" search engine.
+-- Include filters become  tag_ids @> ARRAY[...]  and exclude filters  NOT (tag_ids && ARRAY[...]),
+-- both answered from one GIN index on media.tag_ids.
+--
+-- intarray's gin__int_ops only covers int4[]; tag ids are bigint, so the index uses the built-in
+-- GIN array_ops, which supports the same @> / && operators.
+--
+-- Run with psql outside an explicit transaction: the backfill commits per batch.
+--
+
+ALTER TABLE public.media ADD COLUMN IF NOT EXISTS tag_ids bigint[] DEFAULT '{}'::bigint[] NOT NULL;
+
+
+-- Statement-level like migrations/007: one UPDATE per media row per statement instead of one per
+-- media_tags row (a post with 12 tags would otherwise be rewritten, and re-indexed, 12 times).
+-- Media rows are locked in id order first so concurrent batch loads don't deadlock.
+CREATE OR REPLACE FUNCTION public.sync_media_tag_ids() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM 1 FROM media WHERE id IN (SELECT media_id FROM new_rows) ORDER BY id FOR NO KEY UPDATE;
+        UPDATE media m
+        SET tag_ids = m.tag_ids || ARRAY(SELECT t FROM unnest(d.tag_ids) t WHERE t <> ALL (m.tag_ids))
+        FROM (SELECT media_id, array_agg(DISTINCT tag_id ORDER BY tag_id) AS tag_ids FROM new_rows GROUP BY media_id) d
+        WHERE m.id = d.media_id
+          AND NOT (m.tag_ids @> d.tag_ids);
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM 1 FROM media WHERE id IN (SELECT media_id FROM old_rows) ORDER BY id FOR NO KEY UPDATE;
+        UPDATE media m
+        SET tag_ids = ARRAY(SELECT t FROM unnest(m.tag_ids) WITH ORDINALITY AS u(t, i)
+                            WHERE t <> ALL (d.tag_ids) ORDER BY i)
+        FROM (SELECT media_id, array_agg(tag_id) AS tag_ids FROM old_rows GROUP BY media_id) d
+        WHERE m.id = d.media_id
+          AND m.tag_ids && d.tag_ids;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+
+ALTER FUNCTION public.sync_media_tag_ids() OWNER TO postgres;
+
+-- transition tables allow one event per trigger, hence two
+DROP TRIGGER IF EXISTS trg_sync_media_tag_ids ON public.media_tags;
+DROP TRIGGER IF EXISTS trg_sync_media_tag_ids_insert ON public.media_tags;
+DROP TRIGGER IF EXISTS trg_sync_media_tag_ids_delete ON public.media_tags;
+CREATE TRIGGER trg_sync_media_tag_ids_insert AFTER INSERT ON public.media_tags
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION public.sync_media_tag_ids();
+CREATE TRIGGER trg_sync_media_tag_ids_delete AFTER DELETE ON public.media_tags
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION public.sync_media_tag_ids();
+
+
+-- Backfill existing rows in id ranges so each batch is a short transaction.
+-- The trigger above is already active, but a batch UPDATE racing it is not safe on its own: when the
+-- UPDATE waits on a media row the trigger just changed, it re-checks that row with its old array_agg
+-- result and overwrites tag_ids without the concurrently inserted tag. Each batch therefore holds
+-- media_tags in SHARE mode: tag writes wait for the batch (one short transaction), and the batch sees
+-- every tag committed before it; writes after it go through the trigger on the backfilled array.
+DO $$
+DECLARE
+    batch_size constant bigint := 50000;
+    batch_start bigint;
+    max_id bigint;
+BEGIN
+    SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), -1) INTO batch_start, max_id FROM public.media;
+    WHILE batch_start <= max_id LOOP
+        LOCK TABLE public.media_tags IN SHARE MODE;
+        UPDATE public.media m
+        SET tag_ids = agg.tag_ids
+        FROM (
+            SELECT mt.media_id, array_agg(mt.tag_id ORDER BY mt.tag_id) AS tag_ids
+            FROM public.media_tags mt
+            WHERE mt.media_id >= batch_start AND mt.media_id < batch_start + batch_size
+            GROUP BY mt.media_id
+        ) agg
+        WHERE m.id = agg.media_id
+          AND m.tag_ids IS DISTINCT FROM agg.tag_ids;
+        COMMIT;
+        batch_start := batch_start + batch_size;
+    END LOOP;
+END;
+$$;
+
+
+CREATE INDEX IF NOT EXISTS idx_media_tag_ids ON public.media USING gin (tag_ids);
+
+ANALYZE public.media;
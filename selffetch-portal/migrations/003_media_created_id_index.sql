@@ -0,0 +1,7 @@
+--
+-- Index for keyset (cursor) pagination of search results:
+-- ORDER BY created DESC, id DESC with  (created, id) < ($1, $2)  becomes an index range scan,
+-- so deep pages cost the same as the first one.
+--
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_media_created_id ON public.media USING btree (created DESC, id DESC);
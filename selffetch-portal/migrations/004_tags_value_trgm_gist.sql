@@ -0,0 +1,9 @@
+--
+-- Trigram GiST index for fuzzy tag search:
+-- WHERE value % $1 ORDER BY value <-> $1 LIMIT n  walks this index in similarity order and stops after n rows.
+-- The GIN trigram indexes from db.sql can only filter, not order by distance, so every match had to be sorted.
+--
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm WITH SCHEMA public;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tags_value_trgm_gist ON public.tags USING gist (value public.gist_trgm_ops);
@@ -0,0 +1,6 @@
+--
+-- media_sources is looked up by media_id for every media detail (MEDIA_DETAIL_SQL) but db.sql only
+-- indexes its serial id, so each lookup was a sequential scan of the whole table.
+--
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_media_sources_media_id ON public.media_sources USING btree (media_id);
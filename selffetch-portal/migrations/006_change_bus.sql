@@ -0,0 +1,44 @@
+--
+-- Row change notifications for in-process caches of row metadata (ChangeBus in mediaAPI.py).
+-- migrations/001 covers what the search caches need; these add the rest through one generic
+-- trigger function:  notify_change(channel, key column)  sends  <op>:<key>  on that channel.
+--   media_updated          <op>:<media_id>   posted/likes/type/status/uploader/size changed
+--                                            (created changes already arrive as media_changed U)
+--   media_sources_changed  <op>:<media_id>
+--   favorite_tags_changed  <op>:<tag_id>
+-- op is I (insert), U (update) or D (delete). Identical payloads within one transaction are
+-- collapsed by Postgres, so a bulk update of one media row notifies once.
+--
+
+CREATE OR REPLACE FUNCTION public.notify_change() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    rec record;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        rec := OLD;
+    ELSE
+        rec := NEW;
+    END IF;
+    PERFORM pg_notify(TG_ARGV[0], concat_ws(':', left(TG_OP, 1), to_jsonb(rec) ->> TG_ARGV[1]));
+    RETURN NULL;
+END;
+$$;
+
+
+-- UPDATE OF keeps the trigger quiet for updates that only touch tag_ids (migrations/002 sync trigger)
+DROP TRIGGER IF EXISTS trg_notify_media_updated ON public.media;
+CREATE TRIGGER trg_notify_media_updated AFTER UPDATE OF posted, likes, type, status, uploader_id, width, height ON public.media
+    FOR EACH ROW
+    WHEN ((OLD.posted, OLD.likes, OLD.type, OLD.status, OLD.uploader_id, OLD.width, OLD.height)
+          IS DISTINCT FROM (NEW.posted, NEW.likes, NEW.type, NEW.status, NEW.uploader_id, NEW.width, NEW.height))
+    EXECUTE FUNCTION public.notify_change('media_updated', 'id');
+
+DROP TRIGGER IF EXISTS trg_notify_media_sources_changed ON public.media_sources;
+CREATE TRIGGER trg_notify_media_sources_changed AFTER INSERT OR DELETE OR UPDATE ON public.media_sources
+    FOR EACH ROW EXECUTE FUNCTION public.notify_change('media_sources_changed', 'media_id');
+
+DROP TRIGGER IF EXISTS trg_notify_favorite_tags_changed ON public.favorite_tags;
+CREATE TRIGGER trg_notify_favorite_tags_changed AFTER INSERT OR DELETE OR UPDATE ON public.favorite_tags
+    FOR EACH ROW EXECUTE FUNCTION public.notify_change('favorite_tags_changed', 'tag_id');
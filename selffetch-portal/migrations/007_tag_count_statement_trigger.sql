@@ -0,0 +1,44 @@
+--
+-- tags.count maintenance per statement instead of per row.
+-- db.sql's trg_update_tag_count runs one  UPDATE tags SET count = count +/- 1  for every media_tags
+-- row, so a scraper batch touching a popular tag updates (and row-locks) that tag once per post.
+-- These statement-level triggers read the inserted/deleted rows from a transition table and apply one
+-- aggregated delta per distinct tag. Tags are locked in id order first, so two concurrent batch loads
+-- wait on each other instead of deadlocking.
+--
+-- Only multi-row statements benefit (COPY, INSERT ... SELECT/unnest, DELETE ... WHERE media_id = ANY);
+-- a loop of single-row INSERTs still pays one trigger call per row. See bench_tag_count.py.
+--
+
+CREATE OR REPLACE FUNCTION public.update_tag_count_batch() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM 1 FROM tags WHERE id IN (SELECT tag_id FROM new_rows) ORDER BY id FOR NO KEY UPDATE;
+        UPDATE tags t
+        SET count = COALESCE(t.count, 0) + d.n
+        FROM (SELECT tag_id, COUNT(*) AS n FROM new_rows GROUP BY tag_id) d
+        WHERE t.id = d.tag_id;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM 1 FROM tags WHERE id IN (SELECT tag_id FROM old_rows) ORDER BY id FOR NO KEY UPDATE;
+        UPDATE tags t
+        SET count = COALESCE(t.count, 0) - d.n
+        FROM (SELECT tag_id, COUNT(*) AS n FROM old_rows GROUP BY tag_id) d
+        WHERE t.id = d.tag_id;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+
+ALTER FUNCTION public.update_tag_count_batch() OWNER TO postgres;
+
+-- transition tables allow one event per trigger, hence two
+DROP TRIGGER IF EXISTS trg_update_tag_count ON public.media_tags;
+DROP TRIGGER IF EXISTS trg_update_tag_count_insert ON public.media_tags;
+DROP TRIGGER IF EXISTS trg_update_tag_count_delete ON public.media_tags;
+CREATE TRIGGER trg_update_tag_count_insert AFTER INSERT ON public.media_tags
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION public.update_tag_count_batch();
+CREATE TRIGGER trg_update_tag_count_delete AFTER DELETE ON public.media_tags
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION public.update_tag_count_batch();
@@ -0,0 +1,13 @@
+--
+-- Indexes for the keyset-paginated / streamed favorites and history lists (format=page, format=ndjson):
+-- each list's ORDER BY and cursor row comparison become an index range scan, so a page costs the same
+-- at any depth and a stream starts sending without sorting the whole table first.
+--
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_favorite_media_created_id ON public.favorite_media USING btree (created DESC, id DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_favorite_tags_value_id ON public.favorite_tags USING btree (tag_value, id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_search_history_created_id ON public.search_history USING btree (created DESC, id DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_search_history_user_created_id ON public.search_history USING btree (user_id, created DESC, id DESC);
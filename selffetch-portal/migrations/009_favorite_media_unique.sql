@@ -0,0 +1,28 @@
+--
+-- One favorite_media row per media (per user where the table has user_id), so favoriting can be a
+-- single INSERT ... ON CONFLICT DO NOTHING instead of the racy INSERT ... WHERE NOT EXISTS.
+-- Existing duplicates are removed first (the oldest row is kept).
+-- db.sql has no user_id column; deployments that added it get (media_id, user_id) with NULLS NOT DISTINCT
+-- (PostgreSQL 15+), so the global favorite (user_id NULL) is unique too.
+--
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = 'favorite_media' AND column_name = 'user_id'
+    ) THEN
+        DELETE FROM public.favorite_media f
+        USING public.favorite_media d
+        WHERE f.media_id = d.media_id AND f.user_id IS NOT DISTINCT FROM d.user_id AND f.id > d.id;
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_favorite_media_media_user
+            ON public.favorite_media USING btree (media_id, user_id) NULLS NOT DISTINCT;
+    ELSE
+        DELETE FROM public.favorite_media f
+        USING public.favorite_media d
+        WHERE f.media_id = d.media_id AND f.id > d.id;
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_favorite_media_media
+            ON public.favorite_media USING btree (media_id);
+    END IF;
+END
+$$;
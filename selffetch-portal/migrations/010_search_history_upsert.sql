@@ -0,0 +1,63 @@
+--
+-- One search_history row per distinct search, so saved searches can be written in batches with
+-- INSERT ... ON CONFLICT (the write-behind buffer in mediaAPI.py) and repeats only bump uses/created.
+--
+-- * include_tags / exclude_tags text[] (what the API reads and writes) are added where the table only
+--   has the older include_tags_json / exclude_tags_json columns, and backfilled from them.
+-- * Tag arrays are kept sorted (C collation, same order as Python's sorted()) and without duplicates;
+--   the API normalizes before writing, so the normalize_search_tags trigger and the md5 hash index
+--   are dropped (the hash index ignored favorite_only and the text[] columns).
+-- * Existing duplicates are merged into the newest row, their count kept in the new uses column.
+--
+
+ALTER TABLE public.search_history ADD COLUMN IF NOT EXISTS include_tags text[] NOT NULL DEFAULT '{}';
+ALTER TABLE public.search_history ADD COLUMN IF NOT EXISTS exclude_tags text[] NOT NULL DEFAULT '{}';
+ALTER TABLE public.search_history ADD COLUMN IF NOT EXISTS uses integer NOT NULL DEFAULT 1;
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = 'search_history' AND column_name = 'include_tags_json'
+    ) THEN
+        -- json elements are [value, id] pairs
+        UPDATE public.search_history
+        SET include_tags = ARRAY(SELECT e->>0 FROM jsonb_array_elements(include_tags_json) e),
+            exclude_tags = ARRAY(SELECT e->>0 FROM jsonb_array_elements(exclude_tags_json) e)
+        WHERE include_tags = '{}' AND exclude_tags = '{}';
+    END IF;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_normalize_search_tags ON public.search_history;
+DROP INDEX IF EXISTS public.unique_search_history_hash;
+
+UPDATE public.search_history
+SET include_tags = ARRAY(SELECT DISTINCT t COLLATE "C" FROM unnest(include_tags) t WHERE t IS NOT NULL ORDER BY 1),
+    exclude_tags = ARRAY(SELECT DISTINCT t COLLATE "C" FROM unnest(exclude_tags) t WHERE t IS NOT NULL ORDER BY 1);
+
+UPDATE public.search_history h
+SET uses = d.uses
+FROM (
+    SELECT max(id) FILTER (WHERE rn = 1) OVER w AS keep_id, sum(uses) OVER w AS uses, id
+    FROM (
+        SELECT id, uses, user_id, favorite_only, include_tags, exclude_tags,
+               row_number() OVER (PARTITION BY user_id, favorite_only, include_tags, exclude_tags
+                                  ORDER BY created DESC, id DESC) AS rn
+        FROM public.search_history
+    ) r
+    WINDOW w AS (PARTITION BY user_id, favorite_only, include_tags, exclude_tags)
+) d
+WHERE h.id = d.id AND d.id = d.keep_id;
+
+DELETE FROM public.search_history h
+USING public.search_history k
+WHERE k.user_id IS NOT DISTINCT FROM h.user_id
+  AND k.favorite_only = h.favorite_only
+  AND k.include_tags = h.include_tags
+  AND k.exclude_tags = h.exclude_tags
+  AND (k.created, k.id) > (h.created, h.id);
+
+-- NULLS NOT DISTINCT (PostgreSQL 15+): searches without user_id are one group too
+CREATE UNIQUE INDEX IF NOT EXISTS uq_search_history_search
+    ON public.search_history USING btree (user_id, favorite_only, include_tags, exclude_tags) NULLS NOT DISTINCT;
@@ -0,0 +1,53 @@
+from datetime import datetime
+
+import pytest
+
+from mediaAPI import HTTPException, SearchMediaByTagsRequest, decode_cursor, encode_cursor, search_page_cursors
+
+CREATED = datetime(2024, 5, 1, 12, 30, 15, 250)
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(CREATED, 42, "next")) == (CREATED, 42, "next")
+    assert decode_cursor(encode_cursor(None, 7, "prev")) == (None, 7, "prev")
+
+
+@pytest.mark.parametrize("cursor", ["", "not base64!", encode_cursor(CREATED, 1, "next")[:-4]])
+def test_malformed_cursor_is_400(cursor):
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(cursor)
+    assert exc.value.status_code == 400
+
+
+def test_unknown_direction_is_400():
+    with pytest.raises(HTTPException):
+        decode_cursor(encode_cursor(CREATED, 1, "sideways"))
+
+
+ROWS = [{"created": CREATED, "id": 3}, {"created": CREATED, "id": 2}, {"created": None, "id": 1}]
+
+
+def directions(req, has_more):
+    next_cursor, prev_cursor = search_page_cursors(req, ROWS, has_more)
+    return (decode_cursor(next_cursor) if next_cursor else None,
+            decode_cursor(prev_cursor) if prev_cursor else None)
+
+
+def test_first_page_cursors():
+    req = SearchMediaByTagsRequest()
+    assert directions(req, True) == ((None, 1, "next"), None)
+    assert directions(req, False) == (None, None)
+    assert directions(SearchMediaByTagsRequest(offset=3), False) == (None, (CREATED, 3, "prev"))
+
+
+def test_keyset_page_cursors():
+    after = SearchMediaByTagsRequest(cursor=encode_cursor(CREATED, 4, "next"))
+    assert directions(after, False) == (None, (CREATED, 3, "prev"))
+    before = SearchMediaByTagsRequest(cursor=encode_cursor(CREATED, 0, "prev"))
+    # going back, has_more is about earlier pages; a later page always exists
+    assert directions(before, False) == ((None, 1, "next"), None)
+    assert directions(before, True) == ((None, 1, "next"), (CREATED, 3, "prev"))
+
+
+def test_empty_page_has_no_cursors():
+    assert search_page_cursors(SearchMediaByTagsRequest(), [], True) == (None, None)
@@ -0,0 +1,153 @@
+import asyncio
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime, timedelta
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import mediaAPI
+from mediaAPI import TagPostingIndex, created_sort_key
+
+START = datetime(2024, 1, 1)
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    async def fetch(self, n):
+        chunk, self.rows = self.rows[:n], self.rows[n:]
+        return chunk
+
+
+class FakeConn:
+    """Just enough of an asyncpg connection for TagPostingIndex.load."""
+
+    def __init__(self, media, media_tags, tags, favorites):
+        self.media = media  # media_id -> created
+        self.media_tags = media_tags  # [(media_id, tag_id)]
+        self.tags = tags  # tag_id -> value
+        self.favorites = favorites  # media_id -> count
+        self.during_snapshot = None  # called once the snapshot was read, to simulate concurrent changes
+
+    def transaction(self, **kwargs):
+        return nullcontext()
+
+    async def cursor(self, sql):
+        if "FROM media_tags" in sql:
+            if self.during_snapshot is not None:
+                self.during_snapshot()
+            return FakeCursor((tag_id, media_id) for media_id, tag_id in self.media_tags)
+        rows = sorted(((created_sort_key(c), media_id) for media_id, c in self.media.items()),
+                      key=lambda r: (r[0], -r[1]))
+        return FakeCursor((media_id, key) for key, media_id in rows)
+
+    async def fetch(self, sql, *args):
+        if "FROM tags" in sql:
+            return [{"id": tag_id, "value": value} for tag_id, value in self.tags.items()]
+        ids = args[0] if args else self.favorites
+        return [{"media_id": m, "n": self.favorites[m]} for m in ids if self.favorites.get(m)]
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+def make_conn(count=10):
+    """count media, newest has the highest id; tag 1 on even ids, tag 2 on ids divisible by 3."""
+    media = {i: START + timedelta(hours=i) for i in range(1, count + 1)}
+    media_tags = [(i, 1) for i in media if i % 2 == 0] + [(i, 2) for i in media if i % 3 == 0]
+    return FakeConn(media, media_tags, {1: "even", 2: "three"}, {})
+
+
+def load(conn, chunk_size=4, index=None):
+    index = index or TagPostingIndex()
+    asyncio.run(index.load(FakePool(conn), chunk_size))
+    assert index.ready
+    return index
+
+
+def key(hours):
+    return created_sort_key(START + timedelta(hours=hours))
+
+
+def ids(index, include=(), exclude=(), favorite_only=False):
+    return index.media_ids(index.search(list(include), list(exclude), favorite_only))
+
+
+def test_load_and_search_in_created_order():
+    index = load(make_conn(10))
+    assert ids(index) == list(range(10, 0, -1))
+    assert ids(index, include=[1]) == [10, 8, 6, 4, 2]
+    assert ids(index, include=[1, 2]) == [6]
+    assert ids(index, include=[1], exclude=[2]) == [10, 8, 4, 2]
+    assert index.resolve_tags(["even", "missing"]) == [1, None]
+
+
+def test_appended_media_merge_by_created():
+    index = load(make_conn(10))
+    index.handle_notification("media_changed", f"I:11:{key(11)}")
+    index.handle_notification("media_changed", f"I:12:{key(5.5)}")
+    index.handle_notification("media_tags_changed", "I:12:1")
+    assert ids(index) == [11, 10, 9, 8, 7, 6, 12, 5, 4, 3, 2, 1]
+    assert ids(index, include=[1]) == [10, 8, 6, 12, 4, 2]
+
+
+def test_delete_and_pending_tag_changes():
+    index = load(make_conn(10))
+    index.handle_notification("media_changed", "D:8:")
+    index.handle_notification("media_tags_changed", "D:10:1")
+    index.handle_notification("media_tags_changed", "I:1:1")
+    assert ids(index, include=[1]) == [6, 4, 2, 1]
+    # a removal followed by a re-add of the same pair keeps it
+    index.handle_notification("media_tags_changed", "D:6:1")
+    index.handle_notification("media_tags_changed", "I:6:1")
+    assert ids(index, include=[1]) == [6, 4, 2, 1]
+    assert 8 not in ids(index)
+
+
+def test_estimate_uses_posting_sizes():
+    index = load(make_conn(10))
+    assert index.estimate_count([1], [], False) == 5
+    assert index.estimate_count([1, 2], [], False) == 2  # 10 * 5/10 * 3/10, rounded
+    index.handle_notification("media_changed", "D:1:")
+    assert index.estimate_count([], [], False) == 9
+
+
+def test_changes_during_first_load_are_replayed():
+    conn = make_conn(10)
+    index = TagPostingIndex()
+    conn.during_snapshot = lambda: index.handle_notification("media_tags_changed", "I:1:1")
+    load(conn, index=index)
+    assert ids(index, include=[1]) == [10, 8, 6, 4, 2, 1]
+
+
+def test_favorites_replayed_by_count_not_delta():
+    conn = make_conn(10)
+    conn.favorites = {4: 2}
+    index = load(conn)
+    # favorited while rebuilding: in the snapshot, but notified after it was read
+    conn.favorites[2] = 1
+    conn.during_snapshot = lambda: index.handle_notification("favorite_media_changed", "I:2")
+    load(conn, index=index)
+    assert ids(index, favorite_only=True) == [4, 2]
+    # unfavoriting it once must drop it from favorite_only results
+    index.handle_notification("favorite_media_changed", "D:2")
+    assert ids(index, favorite_only=True) == [4]
+    assert index.estimate_count([], [], True) == 1
+
+
+def test_estimate_after_append_counts_only_live_media():
+    index = load(make_conn(10))
+    assert index.estimate_count([], [1], False) == 5
+    index.handle_notification("media_changed", f"I:11:{created_sort_key(START + timedelta(hours=11))}")
+    # alive grew by spare capacity; that must not count as deleted media
+    assert len(index.alive) > index.size
+    assert index.estimate_count([], [1], False) == 6
+    assert index.estimate_count([], [], False) == 11
@@ -0,0 +1,62 @@
+"""
+Poster frame + sprite sheet extraction for video cards, run inside the VideoThumbnailer process pool
+of mediaAPI (VIDEO_THUMBS).
+
+Kept apart from mediaAPI and limited to the standard library: pool workers are spawned, and a spawned
+worker imports the module of the function it runs, so this is all a worker loads (no FastAPI app, .env,
+caches or numpy). The heavy lifting is ffmpeg / ffprobe in subprocesses.
+"""
+import json
+import os
+import pathlib
+import subprocess
+
+FILES = {"poster": "poster.jpg", "sprite": "sprite.jpg"}
+META = "meta.json"
+
+
+def probe(ffprobe: str, path: str, entries: str) -> dict:
+    """ffprobe the first video stream / container of path; returns the requested entries as strings."""
+    out = subprocess.run(
+        [ffprobe, "-v", "error", "-select_streams", "v:0", "-show_entries", entries, "-of", "json", path],
+        capture_output=True, text=True, check=True, timeout=60,
+    ).stdout
+    probed = json.loads(out)
+    found = dict(probed.get("format") or {})
+    if probed.get("streams"):
+        found.update(probed["streams"][0])
+    return found
+
+
+def render_video_thumbs(source: str, out_dir: str, frames: int, width: int,
+                        ffmpeg: str = "ffmpeg", ffprobe: str = "ffprobe") -> dict:
+    """
+    Write poster.jpg (the most representative of the first frames, ffmpeg's thumbnail filter) and
+    sprite.jpg (frames evenly spaced over the video, scaled to width and tiled in one row) into out_dir,
+    then meta.json describing the sprite. Returns the meta dict.
+    """
+    out = pathlib.Path(out_dir)
+    duration = float(probe(ffprobe, source, "format=duration").get("duration") or 0)
+
+    def run(*args):
+        done = subprocess.run([ffmpeg, "-hide_banner", "-loglevel", "error", "-y", "-i", source, *args],
+                              capture_output=True, timeout=300)
+        if done.returncode != 0:
+            raise RuntimeError(f"ffmpeg exited with {done.returncode}: {done.stderr.decode(errors='replace')[-500:]}")
+
+    run("-vf", "thumbnail", "-frames:v", "1", str(out / "poster.tmp.jpg"))
+    rate = f"{frames}/{duration:.3f}" if duration > 0 else "1"
+    run("-vf", f"fps={rate},scale={width}:-2,tile={frames}x1", "-frames:v", "1", "-q:v", "5",
+        str(out / "sprite.tmp.jpg"))
+    sprite = probe(ffprobe, str(out / "sprite.tmp.jpg"), "stream=width,height")
+    meta = {
+        "frames": frames,
+        "tile_width": int(sprite["width"]) // frames,
+        "tile_height": int(sprite["height"]),
+        "duration": round(duration, 3),
+    }
+    os.replace(out / "poster.tmp.jpg", out / FILES["poster"])
+    os.replace(out / "sprite.tmp.jpg", out / FILES["sprite"])
+    # meta.json last: its presence marks a complete set
+    (out / META).write_text(json.dumps(meta), encoding="utf-8")
+    return meta